@@ -10,6 +10,10 @@ Authors
 """
 import os
 import sys
+import glob
+import fnmatch
+import shutil
+import multiprocessing
 import torch
 import torchaudio
 import speechbrain as sb
@@ -18,28 +22,90 @@ from hyperpyyaml import load_hyperpyyaml
 from speechbrain.utils.metric_stats import MetricStats
 from speechbrain.nnet.loss.stoi_loss import stoi_loss
 from speechbrain.utils.distributed import run_on_main
+from speechbrain.dataio.sampler import DynamicBatchSampler
+from torch.nn import SyncBatchNorm
+from torch.nn.parallel import DistributedDataParallel as DDP
 
 from math import ceil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 # Brain class for speech enhancement training
 class SEBrain(sb.Brain):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # PESQ workers are started at the first validation/test stage and
+        # then reused, instead of one pool per batch
+        self.pesq_pool = None
+        # Threads writing the enhanced wavs, so that the test loop goes on
+        self.save_pool = ThreadPoolExecutor(max_workers=8)
+
     def compute_forward_g(self, noisy_wavs):
         """Forward computations of the generator. Input noisy signal, output clean signal"""
-        noisy_wavs = noisy_wavs.to(self.device)
+        noisy_wavs = noisy_wavs.to(self.device, non_blocking=True)
         predict_wavs = self.modules["model_g"](noisy_wavs)
 
         return predict_wavs
 
     def compute_forward_d(self, noisy_wavs, clean_wavs):
         """Forward computations from discriminator. Input denoised-noisy pair, output whether denoising was properly acheived"""
-        noisy_wavs = noisy_wavs.to(self.device)
-        clean_wavs = clean_wavs.to(self.device)
-        inpt = torch.cat((noisy_wavs, clean_wavs), -1)
+        noisy_wavs = noisy_wavs.to(self.device, non_blocking=True)
+        clean_wavs = clean_wavs.to(self.device, non_blocking=True)
+        # concatenated channel-first, so that the permute at the start of the
+        # discriminator hands a contiguous (batch, channel, time) input to
+        # its first convolution, instead of one it has to copy
+        inpt = torch.cat(
+            (noisy_wavs.transpose(1, 2), clean_wavs.transpose(1, 2)), 1
+        ).transpose(1, 2)
         out = self.modules["model_d"](inpt)
 
         return out
 
+    def get_pad_buffer(self, name, wavs, num_blocks):
+        """Returns a (batch, num_blocks * 16384, 1) view of a reusable device buffer, only re-allocated when a larger batch comes in"""
+        numel = wavs.shape[0] * num_blocks * 16384
+        buf = self.pad_buffers.get(name)
+        if buf is None or buf.numel() < numel or buf.dtype != wavs.dtype:
+            buf = torch.empty(numel, device=self.device, dtype=wavs.dtype)
+            self.pad_buffers[name] = buf
+        return buf[:numel].view(wavs.shape[0], num_blocks * 16384, 1)
+
+    def block_and_pad(self, name, wavs, num_blocks):
+        """Zero-pads (batch, time) wavs to num_blocks * 16384 samples on device and cuts them into (batch * num_blocks, 16384, 1) blocks"""
+        wavs = wavs.to(self.device, non_blocking=True).unsqueeze(-1)
+        wav_size = wavs.shape[1]
+        if wav_size < num_blocks * 16384:
+            # the buffer is never fully zeroed: the signal overwrites its
+            # head, so only the padded tail needs a fill
+            buf = self.get_pad_buffer(name, wavs, num_blocks)
+            buf[:, :wav_size].copy_(wavs)
+            buf[:, wav_size:].zero_()
+            wavs = buf
+        return wavs.view(-1, 16384, 1)
+
+    def get_signal_blocks(self, lens, wav_size, num_blocks):
+        """Returns a mask of the (batch * num_blocks) blocks that hold some signal, or None if all of them do"""
+        lengths = torch.round(lens.cpu() * wav_size)
+        keep = torch.arange(num_blocks) * 16384 < lengths.unsqueeze(1)
+        if keep.all():
+            return None
+        return keep.view(-1)
+
+    def compute_pesq(self, predict, target, lengths):
+        """Computes the PESQ evaluation metric of each signal in the batch"""
+        lengths = (lengths * predict.size(1)).int().cpu()
+        futures = [
+            self.pesq_pool.submit(
+                pesq,
+                fs=16000,
+                ref=t[:length].cpu().numpy(),
+                deg=p[:length].cpu().numpy(),
+                mode="wb",
+            )
+            for p, t, length in zip(predict, target, lengths)
+        ]
+        return torch.tensor([future.result() for future in futures])
+
     def compute_objectives_d1(self, d_outs, batch):
         """Computes the loss of a discriminator given predicted and targeted outputs, with target being clean"""
         loss = self.hparams.compute_cost["d1"](d_outs)
@@ -63,11 +129,11 @@ class SEBrain(sb.Brain):
         data_sizes,
         z_mean=None,
         z_logvar=None,
+        signal_blocks=None,
     ):
         """Computes the loss of the generator based on discriminator and generator losses"""
         clean_wavs_orig, lens = batch.clean_sig
-        clean_wavs_orig = clean_wavs_orig.to(self.device)
-        clean_wavs = clean_wavs.to(self.device)
+        clean_wavs = clean_wavs.to(self.device, non_blocking=True)
 
         loss = self.hparams.compute_cost["g3"](
             d_outs,
@@ -92,14 +158,21 @@ class SEBrain(sb.Brain):
             reduction="batch",
         )
 
-        # un-blocking the predicted wavs for stoi and pesq evaluation
-        num_blocks, wav_size = data_sizes
-        clean_wavs = clean_wavs_orig
-        predict_wavs = predict_wavs.reshape(
-            clean_wavs.shape[0], num_blocks * 16384
-        )[:, : clean_wavs.shape[1]]
-
         if stage != sb.Stage.TRAIN:
+            # un-blocking the predicted wavs for stoi and pesq evaluation
+            num_blocks, wav_size = data_sizes
+            clean_wavs = clean_wavs_orig.to(self.device, non_blocking=True)
+            if signal_blocks is not None:
+                # blocks of padding only were not enhanced, they stay silent
+                all_blocks = predict_wavs.new_zeros(
+                    clean_wavs.shape[0] * num_blocks, 16384, 1
+                )
+                all_blocks[signal_blocks] = predict_wavs
+                predict_wavs = all_blocks
+            predict_wavs = predict_wavs.reshape(
+                clean_wavs.shape[0], num_blocks * 16384
+            )[:, : clean_wavs.shape[1]]
+
             # Evaluate speech quality/intelligibility
             self.stoi_metric.append(
                 batch.id, predict_wavs, clean_wavs, lens, reduction="batch"
@@ -107,19 +180,23 @@ class SEBrain(sb.Brain):
             self.pesq_metric.append(
                 batch.id, predict=predict_wavs, target=clean_wavs, lengths=lens
             )
-            # Write wavs to file
+            # Write wavs to file, in the background
             if stage == sb.Stage.TEST:
                 lens = lens * clean_wavs.shape[1]
+                peaks = predict_wavs.abs().amax(dim=1, keepdim=True)
+                predict_wavs = (predict_wavs / peaks * 0.99).cpu()
                 for name, pred_wav, length in zip(batch.id, predict_wavs, lens):
                     name += ".wav"
                     enhance_path = os.path.join(
                         self.hparams.enhanced_folder, name
                     )
-                    pred_wav = pred_wav / torch.max(torch.abs(pred_wav)) * 0.99
-                    torchaudio.save(
-                        enhance_path,
-                        torch.unsqueeze(pred_wav[: int(length)].cpu(), 0),
-                        16000,
+                    self.save_futures.append(
+                        self.save_pool.submit(
+                            torchaudio.save,
+                            enhance_path,
+                            torch.unsqueeze(pred_wav[: int(length)], 0),
+                            16000,
+                        )
                     )
         return loss
 
@@ -145,73 +222,81 @@ class SEBrain(sb.Brain):
         detached loss
         """
         noisy_wavs, lens = batch.noisy_sig
-        noisy_wavs = torch.unsqueeze(noisy_wavs, -1)
         clean_wavs, lens = batch.clean_sig
-        clean_wavs = torch.unsqueeze(clean_wavs, -1)
 
         # cutting data into ~1 sec blocks (16384 samples - like in segan paper)
-        batch_size = noisy_wavs.shape[0]
         wav_size = noisy_wavs.shape[1]
         num_blocks = ceil(wav_size / 16384)
-        zeros = torch.zeros(batch_size, num_blocks * 16384, 1)
-        zeros[:, :wav_size, :] = noisy_wavs
-        noisy_wavs = zeros.clone()
-        noisy_wavs = torch.reshape(
-            noisy_wavs, (batch_size * num_blocks, 16384, 1)
-        )
-        zeros2 = torch.zeros(batch_size, num_blocks * 16384, 1)
-        zeros2[:, :wav_size, :] = clean_wavs
-        clean_wavs = zeros2.clone()
-        clean_wavs = torch.reshape(
-            clean_wavs, (batch_size * num_blocks, 16384, 1)
-        )
+        noisy_wavs = self.block_and_pad("noisy", noisy_wavs, num_blocks)
+        clean_wavs = self.block_and_pad("clean", clean_wavs, num_blocks)
+
+        # leaving out the blocks that hold padding only (in shorter wavs)
+        signal_blocks = self.get_signal_blocks(lens, wav_size, num_blocks)
+        if signal_blocks is not None:
+            noisy_wavs = noisy_wavs[signal_blocks]
+            clean_wavs = clean_wavs[signal_blocks]
 
         # first of three step training process detailed in SEGAN paper
-        out_d1 = self.compute_forward_d(noisy_wavs, clean_wavs)
-        loss_d1 = self.compute_objectives_d1(out_d1, batch)
-        loss_d1.backward()
+        with torch.cuda.amp.autocast(enabled=self.auto_mix_prec):
+            out_d1 = self.compute_forward_d(noisy_wavs, clean_wavs)
+            loss_d1 = self.compute_objectives_d1(out_d1, batch)
+        self.scaler_d.scale(loss_d1).backward()
+        self.scaler_d.unscale_(self.optimizer_d)
         if self.check_gradients(loss_d1):
-            self.optimizer_d.step()
-        self.optimizer_d.zero_grad()
+            self.scaler_d.step(self.optimizer_d)
+        self.scaler_d.update()
+        self.optimizer_d.zero_grad(set_to_none=True)
 
         # second training step
         z_mean = None
         z_logvar = None
-        if self.modules["model_g"].latent_vae:
-            out_g2, z_mean, z_logvar = self.compute_forward_g(noisy_wavs)
-        else:
-            out_g2 = self.compute_forward_g(noisy_wavs)
-        out_d2 = self.compute_forward_d(out_g2, clean_wavs)
-        loss_d2 = self.compute_objectives_d2(out_d2, batch)
-        loss_d2.backward(retain_graph=True)
+        with torch.cuda.amp.autocast(enabled=self.auto_mix_prec):
+            if self.hparams.latentVAE:
+                out_g2, z_mean, z_logvar = self.compute_forward_g(noisy_wavs)
+            else:
+                out_g2 = self.compute_forward_g(noisy_wavs)
+            # the generator is not updated by this step, so keep it out of the
+            # graph: no retain_graph is needed, this backward frees the
+            # discriminator activations right away, and DDP only allows one
+            # backward per generator forward. It also means check_gradients
+            # clips the discriminator's own gradients only
+            out_d2 = self.compute_forward_d(out_g2.detach(), clean_wavs)
+            loss_d2 = self.compute_objectives_d2(out_d2, batch)
+        self.scaler_d.scale(loss_d2).backward()
+        self.scaler_d.unscale_(self.optimizer_d)
         if self.check_gradients(loss_d2):
-            self.optimizer_d.step()
-        self.optimizer_d.zero_grad()
+            self.scaler_d.step(self.optimizer_d)
+        self.scaler_d.update()
+        self.optimizer_d.zero_grad(set_to_none=True)
 
         # third (last) training step
-        self.optimizer_g.zero_grad()
-        out_d3 = self.compute_forward_d(out_g2, clean_wavs)
-        loss_g3 = self.compute_objectives_g3(
-            out_d3,
-            out_g2,
-            clean_wavs,
-            batch,
-            sb.Stage.TRAIN,
-            (num_blocks, wav_size),
-            z_mean=z_mean,
-            z_logvar=z_logvar,
-        )
-        loss_g3.backward()
+        # out_d2 cannot be reused here: the discriminator has just been
+        # updated, and the generator is trained against the updated one
+        with torch.cuda.amp.autocast(enabled=self.auto_mix_prec):
+            out_d3 = self.compute_forward_d(out_g2, clean_wavs)
+            loss_g3 = self.compute_objectives_g3(
+                out_d3,
+                out_g2,
+                clean_wavs,
+                batch,
+                sb.Stage.TRAIN,
+                (num_blocks, wav_size),
+                z_mean=z_mean,
+                z_logvar=z_logvar,
+                signal_blocks=signal_blocks,
+            )
+        self.scaler_g.scale(loss_g3).backward()
+        # loss_g3 also reached the discriminator through out_d3. These
+        # gradients are dropped before clipping: check_gradients clips the
+        # norm over all modules, and scaler_g does not unscale them
+        self.optimizer_d.zero_grad(set_to_none=True)
+        self.scaler_g.unscale_(self.optimizer_g)
         if self.check_gradients(loss_g3):
-            self.optimizer_g.step()
-        self.optimizer_g.zero_grad()
-        self.optimizer_d.zero_grad()
+            self.scaler_g.step(self.optimizer_g)
+        self.scaler_g.update()
+        self.optimizer_g.zero_grad(set_to_none=True)
 
-        loss_d1.detach().cpu()
-        loss_d2.detach().cpu()
-        loss_g3.detach().cpu()
-
-        return loss_d1 + loss_d2 + loss_g3
+        return (loss_d1 + loss_d2 + loss_g3).detach()
 
     def evaluate_batch(self, batch, stage):
         """Evaluate one batch, override for different procedure than train.
@@ -235,37 +320,40 @@ class SEBrain(sb.Brain):
         detached loss
         """
         noisy_wavs, lens = batch.noisy_sig
-        noisy_wavs = torch.unsqueeze(noisy_wavs, -1)
         clean_wavs, lens = batch.clean_sig
-        clean_wavs = torch.unsqueeze(clean_wavs, -1)
+
         # cutting data into ~1 sec blocks (16384 samples - like in segan paper)
-        batch_size = noisy_wavs.shape[0]
         wav_size = noisy_wavs.shape[1]
         num_blocks = ceil(wav_size / 16384)
-        zeros = torch.zeros(batch_size, num_blocks * 16384, 1)
-        zeros[:, :wav_size, :] = noisy_wavs
-        noisy_wavs = zeros.clone()
-        noisy_wavs = torch.reshape(
-            noisy_wavs, (batch_size * num_blocks, 16384, 1)
-        )
-        zeros = torch.zeros(batch_size, num_blocks * 16384, 1)
-        zeros[:, :wav_size, :] = clean_wavs
-        clean_wavs = zeros.clone()
-        clean_wavs = torch.reshape(
-            clean_wavs, (batch_size * num_blocks, 16384, 1)
-        )
+        noisy_wavs = self.block_and_pad("noisy", noisy_wavs, num_blocks)
+        clean_wavs = self.block_and_pad("clean", clean_wavs, num_blocks)
 
-        out_d1 = self.compute_forward_d(noisy_wavs, clean_wavs)
-        loss_d1 = self.compute_objectives_d1(out_d1, batch)
+        # leaving out the blocks that hold padding only (in shorter wavs)
+        signal_blocks = self.get_signal_blocks(lens, wav_size, num_blocks)
+        if signal_blocks is not None:
+            noisy_wavs = noisy_wavs[signal_blocks]
+            clean_wavs = clean_wavs[signal_blocks]
 
         z_mean = None
         z_logvar = None
-        if self.modules["model_g"].latent_vae:
+        if self.hparams.latentVAE:
             out_g2, z_mean, z_logvar = self.compute_forward_g(noisy_wavs)
         else:
             out_g2 = self.compute_forward_g(noisy_wavs)
-        out_d2 = self.compute_forward_d(out_g2, clean_wavs)
-        loss_d2 = self.compute_objectives_d2(out_d2, batch)
+
+        if self.hparams.eval_discriminator:
+            # no update happens in between (and batch norm uses its running
+            # stats), so both discriminator passes can run as a single batch
+            out_d1, out_d2 = self.compute_forward_d(
+                torch.cat((noisy_wavs, out_g2)),
+                torch.cat((clean_wavs, clean_wavs)),
+            ).chunk(2)
+            loss_d1 = self.compute_objectives_d1(out_d1, batch)
+            loss_d2 = self.compute_objectives_d2(out_d2, batch)
+        else:
+            # pesq/stoi do not depend on the discriminator
+            out_d2 = None
+            loss_d1 = loss_d2 = 0
 
         loss_g3 = self.compute_objectives_g3(
             out_d2,
@@ -276,13 +364,10 @@ class SEBrain(sb.Brain):
             data_sizes=(num_blocks, wav_size),
             z_mean=z_mean,
             z_logvar=z_logvar,
+            signal_blocks=signal_blocks,
         )
 
-        loss_d1.detach().cpu()
-        loss_d2.detach().cpu()
-        loss_g3.detach().cpu()
-
-        return loss_d1 + loss_d2 + loss_g3
+        return (loss_d1 + loss_d2 + loss_g3).detach()
 
     def init_optimizers(self):
         """Called during ``on_fit_start()``, initialize optimizers
@@ -311,6 +396,42 @@ class SEBrain(sb.Brain):
                     "optimizer_d", self.optimizer_d
                 )
 
+        # One scaler per optimizer, as they step on separate losses.
+        # When auto_mix_prec is off these are pass-through.
+        self.scaler_d = torch.cuda.amp.GradScaler(enabled=self.auto_mix_prec)
+        self.scaler_g = torch.cuda.amp.GradScaler(enabled=self.auto_mix_prec)
+
+    def _wrap_distributed(self):
+        """Wraps generator and discriminator separately with DDP. Buffers are
+        not broadcast, as the discriminator runs several forwards per step"""
+        if not self.distributed_launch:
+            return super()._wrap_distributed()
+        for name in ["model_g", "model_d"]:
+            # convert_sync_batchnorm leaves scripted modules untouched, so
+            # each process would silently keep its own batch norm statistics
+            if isinstance(self.modules[name], torch.jit.ScriptModule):
+                raise ValueError(
+                    "jit_module_keys cannot be used with distributed_launch "
+                    "in this recipe, as batch norm would not be synchronized"
+                )
+            module = SyncBatchNorm.convert_sync_batchnorm(self.modules[name])
+            self.modules[name] = DDP(
+                module,
+                device_ids=[self.device],
+                find_unused_parameters=self.find_unused_parameters,
+                broadcast_buffers=False,
+            )
+
+    def on_fit_start(self):
+        """Gets called at the beginning of ``fit()``"""
+        super().on_fit_start()
+        self.pad_buffers = {}
+
+    def on_evaluate_start(self, max_key=None, min_key=None):
+        """Gets called at the beginning of ``evaluate()``"""
+        super().on_evaluate_start(max_key=max_key, min_key=min_key)
+        self.pad_buffers = {}
+
     def on_stage_start(self, stage, epoch=None):
         """Gets called at the beginning of each epoch"""
         self.loss_metric_d1 = MetricStats(
@@ -323,19 +444,15 @@ class SEBrain(sb.Brain):
             metric=self.hparams.compute_cost["g3"]
         )
         self.stoi_metric = MetricStats(metric=stoi_loss)
-
-        # Define function taking (prediction, target) for parallel eval
-        def pesq_eval(pred_wav, target_wav):
-            """Computes the PESQ evaluation metric"""
-            return pesq(
-                fs=16000,
-                ref=target_wav.numpy(),
-                deg=pred_wav.numpy(),
-                mode="wb",
-            )
+        self.save_futures = []
 
         if stage != sb.Stage.TRAIN:
-            self.pesq_metric = MetricStats(metric=pesq_eval, n_jobs=30)
+            if self.pesq_pool is None:
+                self.pesq_pool = ProcessPoolExecutor(
+                    max_workers=30,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            self.pesq_metric = MetricStats(metric=self.compute_pesq)
 
     def on_stage_end(self, stage, stage_loss, epoch=None):
         """Gets called at the end of an epoch."""
@@ -374,6 +491,11 @@ class SEBrain(sb.Brain):
             self.checkpointer.save_and_keep_only(meta=stats, max_keys=["pesq"])
 
         if stage == sb.Stage.TEST:
+            # Wait for the enhanced wavs to be written (and raise any error)
+            for future in self.save_futures:
+                future.result()
+            self.pesq_pool.shutdown()
+            self.pesq_pool = None
             self.hparams.train_logger.log_stats(
                 {"Epoch loaded": self.hparams.epoch_counter.current},
                 test_stats=stats,
@@ -397,6 +519,7 @@ def dataio_prep(hparams):
 
     # Define datasets
     datasets = {}
+    train_bsampler = None
     for dataset in ["train", "valid", "test"]:
         datasets[dataset] = sb.dataio.dataset.DynamicItemDataset.from_json(
             json_path=hparams[f"{dataset}_annotation"],
@@ -405,18 +528,118 @@ def dataio_prep(hparams):
             output_keys=["id", "noisy_sig", "clean_sig"],
         )
 
-    # Sort train dataset
-    if hparams["sorting"] == "ascending" or hparams["sorting"] == "descending":
+    # Stream train dataset from tar shards (batched dynamically by length),
+    # or sort it
+    if hparams["use_webdataset"]:
+        run_on_main(
+            create_shards,
+            kwargs={
+                "dataset": datasets["train"],
+                "shard_folder": hparams["shard_folder"],
+                "maxcount": hparams["shard_maxcount"],
+            },
+        )
+        datasets["train"] = webdataset_prep(hparams)
+    elif (
+        hparams["sorting"] == "ascending" or hparams["sorting"] == "descending"
+    ):
         datasets["train"] = datasets["train"].filtered_sorted(
             sort_key="length", reverse=hparams["sorting"] == "descending"
         )
         hparams["dataloader_options"]["shuffle"] = False
+    elif hparams["sorting"] == "dynamic":
+        # One bucket per number of 16384-sample blocks, so that batches
+        # are not padded with extra blocks for a single long wav
+        lengths = [
+            data["length"] * 16000 for data in datasets["train"].data.values()
+        ]
+        max_blocks = ceil(max(lengths) / 16384)
+        train_bsampler = DynamicBatchSampler(
+            datasets["train"],
+            max_batch_length=hparams["max_batch_length"],
+            left_bucket_length=16384,
+            length_func=lambda x: x["length"] * 16000,
+            shuffle=True,
+            bucket_boundaries=[16384 * i for i in range(1, max_blocks + 1)],
+            seed=hparams["seed"],
+        )
     elif hparams["sorting"] != "random":
         raise NotImplementedError(
-            "Sorting must be random, ascending, or descending"
+            "Sorting must be random, ascending, descending, or dynamic"
+        )
+
+    return datasets, train_bsampler
+
+
+def create_shards(dataset, shard_folder, maxcount):
+    """Packs the decoded signals of a dataset into webdataset tar shards, so
+    that each epoch reads them sequentially instead of decoding every wav."""
+    import webdataset as wds
+
+    # The ids file is written last, into a folder which is only renamed to
+    # shard_folder when complete: shards from a crashed run or from another
+    # train set are rebuilt
+    ids = "\n".join(sorted(dataset.data_ids))
+    ids_file = os.path.join(shard_folder, "ids.txt")
+    if os.path.isfile(ids_file):
+        with open(ids_file) as fin:
+            if fin.read() == ids:
+                return
+    if os.path.isdir(shard_folder):
+        if any(
+            not fnmatch.fnmatch(name, "shard-*.tar") and name != "ids.txt"
+            for name in os.listdir(shard_folder)
+        ):
+            raise ValueError(
+                f"{shard_folder} holds other files than webdataset shards"
+            )
+        shutil.rmtree(shard_folder)
+    tmp_folder = shard_folder + ".tmp"
+    if os.path.isdir(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    create_folder(tmp_folder)
+    sink = wds.ShardWriter(
+        os.path.join(tmp_folder, "shard-%06d.tar"), maxcount=maxcount
+    )
+    for sample in dataset:
+        sink.write(
+            {
+                "__key__": sample["id"],
+                "noisy.pth": sample["noisy_sig"],
+                "clean.pth": sample["clean_sig"],
+            }
         )
+    sink.close()
+    with open(os.path.join(tmp_folder, "ids.txt"), "w") as fout:
+        fout.write(ids)
+    os.rename(tmp_folder, shard_folder)
+
+
+def shard_sample_to_item(sample):
+    """Maps a decoded shard sample to the keys used by SEBrain"""
+    return {
+        "id": sample["__key__"],
+        "noisy_sig": sample["noisy.pth"],
+        "clean_sig": sample["clean.pth"],
+    }
+
 
-    return datasets
+def webdataset_prep(hparams):
+    """Creates the train set as a stream over the tar shards, where batches of
+    similar length are formed on the fly with dynamic bucketing."""
+    import webdataset as wds
+    from speechbrain.dataio.iterators import dynamic_bucketed_batch
+
+    shards = sorted(
+        glob.glob(os.path.join(hparams["shard_folder"], "shard-*.tar"))
+    )
+    return (
+        wds.Dataset(shards)
+        .shuffle(hparams["shuffle_buffer"])
+        .decode()
+        .map(shard_sample_to_item)
+        .then(dynamic_bucketed_batch, **hparams["dynamic_batch_kwargs"])
+    )
 
 
 def create_folder(folder):
@@ -427,6 +650,12 @@ def create_folder(folder):
 # Recipe begins!
 if __name__ == "__main__":
 
+    # This flag enables the inbuilt cudnn auto-tuner. It tunes each input
+    # shape, and the (N, 16384, 1) blocks only take a few distinct N (batch
+    # size x kept blocks, doubled for the fused evaluation discriminator),
+    # so tuned kernels are soon reused
+    torch.backends.cudnn.benchmark = True
+
     # Load hyperparameters file with command-line overrides
     hparams_file, run_opts, overrides = sb.parse_arguments(sys.argv[1:])
     with open(hparams_file) as fin:
@@ -448,7 +677,7 @@ if __name__ == "__main__":
     )
 
     # Create dataset objects
-    datasets = dataio_prep(hparams)
+    datasets, train_bsampler = dataio_prep(hparams)
 
     # Create experiment directory
     sb.create_experiment_directory(
@@ -475,12 +704,32 @@ if __name__ == "__main__":
         checkpointer=hparams["checkpointer"],
     )
 
+    # The webdataset pipeline and the dynamic batch sampler form whole batches
+    train_loader_kwargs = dict(hparams["dataloader_options"])
+    if hparams["use_webdataset"]:
+        if se_brain.distributed_launch:
+            raise ValueError(
+                "use_webdataset is not supported with distributed_launch, "
+                "as the shards would not be split across processes"
+            )
+        train_loader_kwargs["batch_size"] = None
+    elif train_bsampler is not None:
+        if se_brain.distributed_launch:
+            raise ValueError(
+                "sorting: dynamic is not supported with distributed_launch, "
+                "as the batch sampler would not be split across processes"
+            )
+        train_loader_kwargs.pop("batch_size")
+        train_loader_kwargs["batch_sampler"] = train_bsampler
+        # so that fit() calls set_epoch and batches are reshuffled each epoch
+        se_brain.train_sampler = train_bsampler
+
     # Load latest checkpoint to resume training
     se_brain.fit(
         epoch_counter=se_brain.hparams.epoch_counter,
         train_set=datasets["train"],
         valid_set=datasets["valid"],
-        train_loader_kwargs=hparams["dataloader_options"],
+        train_loader_kwargs=train_loader_kwargs,
         valid_loader_kwargs=hparams["dataloader_options"],
     )
 
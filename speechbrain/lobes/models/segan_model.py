@@ -31,6 +31,9 @@ class Generator(torch.nn.Module):
         Whether to remove the latent variable concatenation. Is only applicable if latent_vae is False
     """
 
+    # constants, so that torch.jit.script only compiles the chosen variant
+    __constants__ = ["latent_vae", "z_prob"]
+
     def __init__(self, kernel_size, latent_vae, z_prob):
         super().__init__()
         self.EncodeLayers = torch.nn.ModuleList()
@@ -94,9 +97,7 @@ class Generator(torch.nn.Module):
         for i, layer in enumerate(self.EncodeLayers):
             x = layer(x)
             skips.append(x.clone())
-            if i == len(self.DecodeLayers) - 1:
-                continue
-            else:
+            if i != len(self.DecodeLayers) - 1:
                 x = F.leaky_relu(x, negative_slope=0.3)
 
         # fuse z
@@ -106,20 +107,16 @@ class Generator(torch.nn.Module):
                 z_logvar
             )  # sampling from latent var probability distribution
         elif self.z_prob:
-            z = torch.normal(torch.zeros(x.shape), torch.ones(x.shape))
-            z = z.to(x.device)
+            z = torch.randn_like(x)
             x = torch.cat((x, z), 1)
         else:
-            z = torch.zeros(x.shape)
-            z = z.to(x.device)
+            z = torch.zeros_like(x)
             x = torch.cat((x, z), 1)
 
         # decode
         for i, layer in enumerate(self.DecodeLayers):
             x = layer(x)
-            if i == len(self.DecodeLayers) - 1:
-                continue
-            else:
+            if i != len(self.DecodeLayers) - 1:
                 x = torch.cat((x, skips[-1 * (i + 2)]), 1)
                 x = F.leaky_relu(x, negative_slope=0.3)
         x = x.permute(0, 2, 1)
@@ -181,9 +178,9 @@ class Discriminator(torch.nn.Module):
         """forward pass through the discriminator"""
         x = x.permute(0, 2, 1)
         # encode
-        for i in range(len(self.Norms)):
-            x = self.Layers[i](x)
-            x = self.Norms[i](x)
+        for layer, norm in zip(self.Layers, self.Norms):
+            x = layer(x)
+            x = norm(x)
             x = F.leaky_relu(x, negative_slope=0.3)
 
         # output
@@ -224,14 +221,18 @@ def g3_loss(
     z_logvar=None,
     reduction="mean",
 ):
-    """Calculates the loss of the generator given the discriminator outputs    """
-    discrimloss = 0.5 * ((d_outputs - 1) ** 2)
+    """Calculates the loss of the generator given the discriminator outputs.
+    If d_outputs is None, only the reconstruction (and kl) terms are used."""
+    if d_outputs is None:
+        discrimloss = predictions.new_zeros(predictions.size(0), 1)
+    else:
+        discrimloss = 0.5 * ((d_outputs - 1) ** 2)
     l1norm = torch.nn.functional.l1_loss(predictions, targets, reduction="none")
 
     if not (
         z_mean is None
     ):  # This will determine if model is being trained as a vae
-        ZERO = torch.zeros(z_mean.size()).to(z_mean.device)
+        ZERO = torch.zeros_like(z_mean)
         distq = torch.distributions.normal.Normal(
             z_mean, torch.exp(z_logvar) ** (1 / 2)
         )
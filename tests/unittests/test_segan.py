@@ -0,0 +1,64 @@
+import torch
+import pytest
+
+
+@pytest.mark.parametrize(
+    "latent_vae, z_prob",
+    [(False, False), (False, True), (True, False), (True, True)],
+)
+def test_segan_generator_jit(latent_vae, z_prob):
+
+    from speechbrain.lobes.models.segan_model import Generator
+
+    inputs = torch.rand([2, 16384, 1])
+    model = Generator(kernel_size=5, latent_vae=latent_vae, z_prob=z_prob)
+    model.eval()
+    scripted = torch.jit.script(model)
+
+    # the same seed gives the same latent sample in both modes
+    torch.manual_seed(0)
+    outputs = model(inputs)
+    torch.manual_seed(0)
+    outputs_jit = scripted(inputs)
+
+    if latent_vae:
+        assert len(outputs) == len(outputs_jit) == 3
+    else:
+        outputs, outputs_jit = [outputs], [outputs_jit]
+    for output, output_jit in zip(outputs, outputs_jit):
+        assert torch.allclose(output, output_jit, atol=1e-6)
+    assert outputs[0].shape == inputs.shape
+
+
+def test_segan_discriminator_jit():
+
+    from speechbrain.lobes.models.segan_model import Discriminator
+
+    inputs = torch.rand([2, 16384, 2])
+    model = Discriminator(kernel_size=5)
+    model.eval()
+    scripted = torch.jit.script(model)
+
+    output = model(inputs)
+    output_jit = scripted(inputs)
+    assert output.shape == (2, 1, 1)
+    assert torch.allclose(output, output_jit, atol=1e-6)
+
+
+def test_segan_g3_loss_without_discriminator():
+
+    from speechbrain.lobes.models.segan_model import g3_loss
+
+    predictions = torch.rand([3, 16384, 1])
+    targets = torch.rand([3, 16384, 1])
+    lengths = torch.ones(3)
+    l1 = torch.nn.functional.l1_loss(predictions, targets, reduction="none")
+
+    loss = g3_loss(None, predictions, targets, lengths, 100, 1)
+    assert torch.allclose(loss, 100 * l1.mean())
+
+    loss = g3_loss(
+        None, predictions, targets, lengths, 100, 1, reduction="batch"
+    )
+    assert loss.shape == (3,)
+    assert torch.allclose(loss, 100 * l1.view(3, -1).mean(1))